@@ -1,9 +1,72 @@
+import os
+import time
+import wave
+import tempfile
+import threading
+import importlib
 import ffmpeg
 import numpy as np
-import librosa
-from scipy.io.wavfile import write
 from flask import Flask, request, jsonify
 
+PROCESS_START = time.monotonic()
+WARMUP_WAIT_SECONDS = int(os.getenv('WARMUP_WAIT_SECONDS', '60'))
+
+# librosa тянет numba; импорт и первый JIT делаем в фоне (warm_up), чтобы /health отвечал сразу
+librosa = None
+
+STARTUP = {'status': 'starting', 'timings': {}, 'error': None, 'ready_after': None}
+_ready = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+
+def _timed(name, fn):
+    started = time.monotonic()
+    result = fn()
+    STARTUP['timings'][name] = round(time.monotonic() - started, 3)
+    return result
+
+
+def _run_sample_analysis():
+    """Push one second of silence through the request code path so numba compiles (or loads its cache)."""
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(b'\x00\x00' * 16000)
+        AudioProcessor().split_audio(path, sample_file=path, normalize=False)
+    finally:
+        os.remove(path)
+
+
+def warm_up():
+    """Import librosa and run a sample analysis, recording how long each step took."""
+    global librosa
+    STARTUP['status'] = 'loading'
+    try:
+        librosa = _timed('import librosa', lambda: importlib.import_module('librosa'))
+        _timed('sample analysis', _run_sample_analysis)
+        STARTUP['status'] = 'ready'
+    except Exception as e:
+        STARTUP['status'] = 'error'
+        STARTUP['error'] = str(e)
+    finally:
+        STARTUP['ready_after'] = round(time.monotonic() - PROCESS_START, 3)
+        _ready.set()
+        print(f"Startup {STARTUP['status']} after {STARTUP['ready_after']}s: {STARTUP['timings']}", flush=True)
+
+
+def start_warmup():
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_up, name='warmup', daemon=True)
+            _warmup_thread.start()
+
+
 class AudioProcessor:
     _instance = None
 
@@ -14,9 +77,14 @@ class AudioProcessor:
         return cls._instance
 
 
-    def extract_audio(self, v, out_audio='temp.wav'):
+    def extract_audio(self, v, out_audio='temp.wav', start=None, end=None):
+        input_args = {}
+        if start:
+            input_args['ss'] = start
+        if end is not None:
+            input_args['t'] = end - (start or 0)
         try:
-            ffmpeg.input(v).output(out_audio, vn=None, acodec='pcm_s16le', ac=1, ar='16000').run(overwrite_output=True)
+            ffmpeg.input(v, **input_args).output(out_audio, vn=None, acodec='pcm_s16le', ac=1, ar='16000').run(overwrite_output=True)
         except Exception:
             raise ValueError(f'failed to bla bla bla extract audio from {v}')
 
@@ -38,7 +106,8 @@ class AudioProcessor:
         return result
 
 
-    def split_audio(self, audio_file='temp.wav', sample_file=None, frame_duration=1, threshold=60):
+    def split_audio(self, audio_file='temp.wav', sample_file=None, frame_duration=1, threshold=60,
+                    offset=0, normalize=True):
         audio, sr = librosa.load(audio_file, sr=None)
         sample, _ = librosa.load(sample_file, sr=sr)
         frame_len = int(frame_duration * sr)
@@ -52,7 +121,11 @@ class AudioProcessor:
             diff = self.spectral_diff(frame, sample)
             if diff >= threshold:
                 result = self.calculate_noise_qual(frame, all_quals)
-                noise_qual[f'({i / sr}, {(i + frame_len) / sr})'] = result
+                noise_qual[f'({offset + i / sr}, {offset + (i + frame_len) / sr})'] = result
+
+        if not normalize:
+            # сегмент: нормирует вызывающий по min/max всей записи
+            return noise_qual, (min(all_quals) if all_quals else None), (max(all_quals) if all_quals else None)
 
         min_qual = min(all_quals)
         max_qual = max(all_quals)
@@ -66,8 +139,22 @@ class AudioProcessor:
 
 app = Flask(__name__)
 
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': STARTUP['status'],
+                    'uptime': round(time.monotonic() - PROCESS_START, 3),
+                    'startup': STARTUP})
+
+
 @app.route('/process_audio', methods=['POST'])
 def api_process_audio():
+    start_warmup()
+    if not _ready.wait(timeout=WARMUP_WAIT_SECONDS):
+        return jsonify({'error': 'librosa is still loading', 'startup': STARTUP}), 503
+    if STARTUP['status'] != 'ready':
+        return jsonify({'error': f"startup failed: {STARTUP['error']}", 'startup': STARTUP}), 503
+
     data = request.json
     video_path = data.get('video_path')
     sample_path = data.get('sample_path')
@@ -75,14 +162,31 @@ def api_process_audio():
     if not video_path or not sample_path:
         return jsonify({'error': 'video_path and sample_path are required'}), 400
 
+    start = data.get('start')
+    end = data.get('end')
+    normalize = data.get('normalize', True)
+
+    # у параллельных сегментов свой временный wav
+    fd, out_audio = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
     try:
         audio_processor = AudioProcessor()
-        audio_processor.extract_audio(video_path)
-        result = audio_processor.split_audio(sample_file=sample_path)
-        return jsonify({'result': result})
+        audio_processor.extract_audio(video_path, out_audio, start=start, end=end)
+        if normalize:
+            result = audio_processor.split_audio(out_audio, sample_file=sample_path, offset=start or 0)
+            return jsonify({'result': result})
+        result, min_qual, max_qual = audio_processor.split_audio(
+            out_audio, sample_file=sample_path, offset=start or 0, normalize=False)
+        return jsonify({'result': {k: float(v) for k, v in result.items()},
+                        'min': None if min_qual is None else float(min_qual),
+                        'max': None if max_qual is None else float(max_qual)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if os.path.exists(out_audio):
+            os.remove(out_audio)
 
 
 if __name__ == '__main__':
+    start_warmup()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
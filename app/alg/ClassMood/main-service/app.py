@@ -1,16 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import os
 import requests
 import traceback
 import ast
+import struct
+import sys
+import threading
+import time
+from array import array
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from statistics import median
+from urllib.parse import urljoin
 
 
 app = Flask(__name__)
 
 VIDEO_PROCESSING_URL = os.getenv('VIDEO_PROCESSING_URL', 'http://video-service:5000/process_video')
 AUDIO_PROCESSING_URL = os.getenv('AUDIO_PROCESSING_URL', 'http://audio-service:5000/process_audio')
+# Несколько реплик через запятую; по умолчанию одна
+VIDEO_PROCESSING_URLS = [u.strip() for u in os.getenv('VIDEO_PROCESSING_URLS', VIDEO_PROCESSING_URL).split(',') if u.strip()]
+AUDIO_PROCESSING_URLS = [u.strip() for u in os.getenv('AUDIO_PROCESSING_URLS', AUDIO_PROCESSING_URL).split(',') if u.strip()]
+# Целое число секунд, чтобы границы сегментов совпадали с секундными аудио-окнами
+SEGMENT_SECONDS = int(os.getenv('SEGMENT_SECONDS', '300'))
+SEGMENT_ATTEMPTS = int(os.getenv('SEGMENT_ATTEMPTS', '3'))
+SEGMENT_TIMEOUT = int(os.getenv('SEGMENT_TIMEOUT', '600'))
 
 
 def median_exponential_smoothing(values, window=7, alpha=0.1):
@@ -34,6 +48,16 @@ def median_exponential_smoothing(values, window=7, alpha=0.1):
     return final_smoothed
 
 
+def pack_series(result):
+    """Pack {t: value} into the API's binary series format: b"CMS1", uint32 n, float32 t[n], float32 value[n] (LE)."""
+    times = array('f', result.keys())
+    values = array('f', result.values())
+    if sys.byteorder != 'little':
+        times.byteswap()
+        values.byteswap()
+    return struct.pack('<4sI', b'CMS1', len(times)) + times.tobytes() + values.tobytes()
+
+
 def merge_interest_dicts(dict_points, dict_intervals):
     modulated_values = []
 
@@ -58,9 +82,9 @@ def merge_interest_dicts(dict_points, dict_intervals):
     return final_dict
 
 
-def call_video_processing(video_path):
-    payload = {'video_path': video_path}
-    response = requests.post(VIDEO_PROCESSING_URL, json=payload, timeout=30)
+def call_video_processing(video_path, url=VIDEO_PROCESSING_URL, start=None, end=None, timeout=SEGMENT_TIMEOUT):
+    payload = {'video_path': video_path, 'start': start, 'end': end}
+    response = requests.post(url, json=payload, timeout=timeout)
 
     if response.status_code == 200:
         return response.json()
@@ -68,9 +92,11 @@ def call_video_processing(video_path):
         raise Exception(f'Video service error: {response.status_code} {response.text}')
 
 
-def call_audio_processing(video_path, sample_path):
-    payload = {'video_path': video_path, 'sample_path': sample_path}
-    response = requests.post(AUDIO_PROCESSING_URL, json=payload, timeout=30)
+def call_audio_processing(video_path, sample_path, url=AUDIO_PROCESSING_URL, start=None, end=None,
+                          timeout=SEGMENT_TIMEOUT):
+    payload = {'video_path': video_path, 'sample_path': sample_path,
+               'start': start, 'end': end, 'normalize': False}
+    response = requests.post(url, json=payload, timeout=timeout)
 
     if response.status_code == 200:
         return response.json()
@@ -78,6 +104,161 @@ def call_audio_processing(video_path, sample_path):
         raise Exception(f'Audio service error: {response.status_code} {response.text}')
 
 
+def probe_duration(video_path):
+    """Ask the first video replica that answers for the video duration in seconds."""
+    for url in VIDEO_PROCESSING_URLS:
+        try:
+            response = requests.post(urljoin(url, 'probe_video'), json={'video_path': video_path}, timeout=30)
+            if response.status_code == 200:
+                return response.json().get('duration')
+        except requests.RequestException as e:
+            print(f'Probe failed on {url}: {e}')
+    return None
+
+
+def split_segments(duration):
+    if not duration or duration <= SEGMENT_SECONDS:
+        return [(0, None)]
+    segments = []
+    start = 0
+    while start < duration:
+        end = start + SEGMENT_SECONDS
+        # последний сегмент открыт справа, чтобы не потерять хвост из-за неточной длительности
+        segments.append((start, end if end < duration else None))
+        start = end
+    return segments
+
+
+class Replicas:
+    """Free replica URLs of one service, shared by all requests.
+
+    A segment takes a free replica, runs on it and hands it back, so the next
+    segment goes to whichever replica is idle rather than a fixed one.
+    """
+
+    def __init__(self, urls):
+        self._urls = list(urls)
+        self._free = list(urls)
+        self._cond = threading.Condition()
+
+    def acquire(self, avoid=()):
+        """Take a free replica not in avoid, waiting for one to free up.
+
+        avoid only falls back to a replica it names once every replica is in it.
+        """
+        with self._cond:
+            if all(u in avoid for u in self._urls):
+                avoid = ()
+            while not any(u not in avoid for u in self._free):
+                self._cond.wait()
+            url = next(u for u in self._free if u not in avoid)
+            self._free.remove(url)
+            return url
+
+    def release(self, url):
+        with self._cond:
+            self._free.append(url)
+            # a waiter may be avoiding this replica, so wake them all to re-check
+            self._cond.notify_all()
+
+
+VIDEO_REPLICAS = Replicas(VIDEO_PROCESSING_URLS)
+AUDIO_REPLICAS = Replicas(AUDIO_PROCESSING_URLS)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def with_failover(call, replicas, deadline, *args, **kwargs):
+    """Run call on a free replica, retrying on a different one after each failure.
+
+    Gives up once the caller's deadline has passed, so nobody keeps working
+    for a client that has stopped waiting.
+    """
+    last_error = None
+    tried = []
+    for _ in range(max(1, SEGMENT_ATTEMPTS)):
+        url = replicas.acquire(avoid=tried)
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded('Client deadline passed')
+            return call(*args, url=url, timeout=min(SEGMENT_TIMEOUT, remaining), **kwargs)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+            tried.append(url)
+            print(f'Segment {kwargs.get("start")}-{kwargs.get("end")} failed on {url}: {e}')
+        finally:
+            replicas.release(url)
+    raise last_error
+
+
+def process_segments(video_path, sample_path, duration=None, timeout=None):
+    """Fan the video out to all replicas segment by segment and stitch one timeline back.
+
+    Timestamps come back absolute from the services. Audio is requested raw and
+    normalised here over the whole recording, and smoothing runs once on the
+    stitched series, so segment boundaries leave no trace in the result.
+    timeout is how long the caller will wait; once it passes, or any segment
+    fails for good, segments not yet started are dropped.
+    """
+    deadline = time.monotonic() + (timeout or float('inf'))
+    if duration is None:
+        duration = probe_duration(video_path)
+    segments = split_segments(duration)
+    # не больше сегментов одновременно, чем реплик; какая реплика свободна, решает Replicas
+    video_pool = ThreadPoolExecutor(max_workers=min(len(segments), len(VIDEO_PROCESSING_URLS)))
+    audio_pool = ThreadPoolExecutor(max_workers=min(len(segments), len(AUDIO_PROCESSING_URLS)))
+    try:
+        video_futures = [
+            video_pool.submit(with_failover, call_video_processing, VIDEO_REPLICAS, deadline,
+                              video_path, start=start, end=end)
+            for start, end in segments
+        ]
+        audio_futures = [
+            audio_pool.submit(with_failover, call_audio_processing, AUDIO_REPLICAS, deadline,
+                              video_path, sample_path, start=start, end=end)
+            for start, end in segments
+        ]
+        video_parts = [f.result() for f in video_futures]
+        audio_parts = [f.result() for f in audio_futures]
+    finally:
+        # on failure the queued segments are cancelled instead of running for nobody
+        video_pool.shutdown(wait=False, cancel_futures=True)
+        audio_pool.shutdown(wait=False, cancel_futures=True)
+
+    result_video = {}
+    for part in video_parts:
+        result_video.update({float(k): v for k, v in part['result'].items()})
+    result_video = dict(sorted(result_video.items()))
+
+    result_audio_raw = {}
+    qual_bounds = []
+    for part in audio_parts:
+        result_audio_raw.update(part['result'])
+        if part.get('min') is not None:
+            qual_bounds.extend((part['min'], part['max']))
+
+    result_audio = {}
+    if qual_bounds:
+        min_qual, max_qual = min(qual_bounds), max(qual_bounds)
+        span = (max_qual - min_qual) or 1
+        for key_str, value in result_audio_raw.items():
+            try:
+                key_tuple = ast.literal_eval(key_str)
+                if isinstance(key_tuple, tuple) and len(key_tuple) == 2:
+                    result_audio[key_tuple] = min(max((value - min_qual) / span * 100, 0), 100)
+                else:
+                    print(f'Invalid key format: {key_str}')
+            except Exception as e:
+                print(f'Error parsing key {key_str}: {e}')
+
+    return merge_interest_dicts(result_video, result_audio)
+
+
 @app.route('/process', methods=['POST'])
 def process():
     try:
@@ -91,23 +272,9 @@ def process():
         if not video_path or not sample_path:
             return jsonify({'error': 'video_path and sample_path are required'}), 400
 
-        result_video_raw = call_video_processing(video_path)['result']
-        result_audio_raw = call_audio_processing(video_path, sample_path)['result']
-
-        result_video = {float(k): v for k, v in result_video_raw.items()}
-        result_audio = {}
-
-        for key_str, value in result_audio_raw.items():
-            try:
-                key_tuple = ast.literal_eval(key_str)
-                if isinstance(key_tuple, tuple) and len(key_tuple) == 2:
-                    result_audio[key_tuple] = value
-                else:
-                    print(f'Invalid key format: {key_str}')
-            except Exception as e:
-                print(f'Error parsing key {key_str}: {e}')
-
-        merged_result = merge_interest_dicts(result_video, result_audio)
+        merged_result = process_segments(video_path, sample_path, data.get('duration'), data.get('timeout'))
+        if data.get('format') == 'binary':
+            return Response(pack_series(merged_result), mimetype='application/vnd.classmood.series')
         return jsonify(merged_result)
 
     except Exception as e:
@@ -1,31 +1,90 @@
 import os
-import cv2
-import torch
-import torch.nn as nn
-import mediapipe as mp
+import math
+import time
+import threading
+import importlib
 from pathlib import Path
 from collections import deque
 from statistics import median
-from ultralytics import YOLO
 from flask import Flask, request, jsonify
 
+PROCESS_START = time.monotonic()
+
 MODEL_PATH = os.getenv('INTEREST_MODEL_PATH', 'models/interest_predictor.pth')
 FACE_MODEL_PATH = os.getenv('FACE_MODEL_PATH', 'models/yolov8n-face-lindevs.pt')
+WARMUP_WAIT_SECONDS = int(os.getenv('WARMUP_WAIT_SECONDS', '120'))
+
+# torch, ultralytics, mediapipe и cv2 грузятся в фоне (warm_up), чтобы /health отвечал сразу
+cv2 = None
+torch = None
+mp = None
+YOLO = None
+
+STARTUP = {'status': 'starting', 'timings': {}, 'error': None, 'ready_after': None}
+_ready = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+
+def _timed(name, fn):
+    started = time.monotonic()
+    result = fn()
+    STARTUP['timings'][name] = round(time.monotonic() - started, 3)
+    return result
+
+
+def import_heavy_modules():
+    global cv2, torch, mp, YOLO
+    cv2 = _timed('import cv2', lambda: importlib.import_module('cv2'))
+    torch = _timed('import torch', lambda: importlib.import_module('torch'))
+    mp = _timed('import mediapipe', lambda: importlib.import_module('mediapipe'))
+    YOLO = _timed('import ultralytics', lambda: importlib.import_module('ultralytics')).YOLO
+
+
+def warm_up(load_models=True):
+    """Import the heavy stack and build the model singletons, recording how long each step took."""
+    STARTUP['status'] = 'loading'
+    try:
+        import_heavy_modules()
+        if load_models:
+            _timed('load interest model', ServiceFactory.create_interest_service)
+            _timed('load face models', ServiceFactory.create_headpose_service)
+        STARTUP['status'] = 'ready'
+    except Exception as e:
+        STARTUP['status'] = 'error'
+        STARTUP['error'] = str(e)
+    finally:
+        STARTUP['ready_after'] = round(time.monotonic() - PROCESS_START, 3)
+        _ready.set()
+        print(f"Startup {STARTUP['status']} after {STARTUP['ready_after']}s: {STARTUP['timings']}", flush=True)
+
+
+def start_warmup():
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_up, name='warmup', daemon=True)
+            _warmup_thread.start()
 
 # Инициализация модели
 
-class InterestPredictor(nn.Module):
-    def __init__(self, input_size=3, hidden_size=10):
-        super(InterestPredictor, self).__init__()
-        self.fc1 = nn.Linear(input_size, hidden_size)
-        self.relu = nn.ReLU()
-        self.fc2 = nn.Linear(hidden_size, 1)
+def build_interest_predictor(input_size=3, hidden_size=10):
+    nn = torch.nn
 
-    def forward(self, x):
-        x = self.fc1(x)
-        x = self.relu(x)
-        x = self.fc2(x)
-        return x
+    class InterestPredictor(nn.Module):
+        def __init__(self):
+            super(InterestPredictor, self).__init__()
+            self.fc1 = nn.Linear(input_size, hidden_size)
+            self.relu = nn.ReLU()
+            self.fc2 = nn.Linear(hidden_size, 1)
+
+        def forward(self, x):
+            x = self.fc1(x)
+            x = self.relu(x)
+            x = self.fc2(x)
+            return x
+
+    return InterestPredictor()
 
 
 class InterestPredictorService:
@@ -44,7 +103,7 @@ class InterestPredictorService:
         if not self.model_path.exists():
             raise FileNotFoundError(f'Model not found: {self.model_path}')
         
-        self.model = InterestPredictor(input_size=2, hidden_size=10)
+        self.model = build_interest_predictor(input_size=2, hidden_size=10)
         self.model.load_state_dict(torch.load(self.model_path, map_location='cpu'))
         self.model.eval()
         self._initialized = True
@@ -57,20 +116,28 @@ class InterestPredictorService:
 # Фабрика
 
 class ServiceFactory:
+    _headpose_services = {}
+
     @staticmethod
     def create_interest_service(model_path: str = MODEL_PATH):
         return InterestPredictorService(model_path)
     
     @staticmethod
     def create_headpose_service(face_model_path: str = FACE_MODEL_PATH):
-        return HeadPoseService(face_model_path)
+        # YOLO и FaceMesh дорого создавать на каждый запрос, держим по экземпляру на модель
+        services = ServiceFactory._headpose_services
+        if face_model_path not in services:
+            services[face_model_path] = HeadPoseService(face_model_path)
+        return services[face_model_path]
 
 # Основной сервис
 
 class HeadPoseService:
-    __slots__ = ('bb_detection', 'face_mesh', 'interest_service')
+    __slots__ = ('bb_detection', 'face_mesh', 'interest_service', 'lock')
 
     def __init__(self, face_model_path: str):
+        # общий экземпляр на все потоки Flask, а FaceMesh не потокобезопасен
+        self.lock = threading.Lock()
         self.bb_detection = YOLO(face_model_path)
         self.face_mesh = mp.solutions.face_mesh.FaceMesh(
             static_image_mode=True,
@@ -127,24 +194,32 @@ class HeadPoseService:
 
         return head_rotations
 
-    def video_interest(self, path, frame_skip=10):
+    def video_interest(self, path, frame_skip=10, start=None, end=None):
         interest_service = ServiceFactory.create_interest_service()
         cap = cv2.VideoCapture(path)
         if not cap.isOpened():
             raise ValueError(f'Failed to open video {path}')
 
-        frame_count = 0
         fps = cap.get(cv2.CAP_PROP_FPS)
+        # Сегмент [start, end) в кадрах; первый кадр выравниваем по сетке frame_skip всего видео,
+        # чтобы соседние сегменты давали те же отсчёты, что и обработка целиком
+        frame_count = math.ceil((start or 0) * fps / frame_skip) * frame_skip
+        last_frame = math.ceil(end * fps) if end is not None else None
+        if frame_count:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
         interest_per_time = {}
 
         while cap.isOpened():
+            if last_frame is not None and frame_count >= last_frame:
+                break
             ret, frame = cap.read()
             if not ret:
                 break
 
             if frame_count % frame_skip == 0:
                 try:
-                    temp = self.frame_headpose(frame)
+                    with self.lock:
+                        temp = self.frame_headpose(frame)
                     predicted = []
                     for face_id, (yaw, pitch) in temp.items():
                         score = int(interest_service.predict((yaw, pitch)))
@@ -162,8 +237,29 @@ class HeadPoseService:
 
 app = Flask(__name__)
 
+
+def wait_until_ready():
+    """Return an error response if the models are not usable yet, otherwise None."""
+    start_warmup()
+    if not _ready.wait(timeout=WARMUP_WAIT_SECONDS):
+        return jsonify({'error': 'models are still loading', 'startup': STARTUP}), 503
+    if STARTUP['status'] != 'ready':
+        return jsonify({'error': f"startup failed: {STARTUP['error']}", 'startup': STARTUP}), 503
+    return None
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': STARTUP['status'],
+                    'uptime': round(time.monotonic() - PROCESS_START, 3),
+                    'startup': STARTUP})
+
+
 @app.route('/process_video', methods=['POST'])
 def process_video():
+    not_ready = wait_until_ready()
+    if not_ready:
+        return not_ready
     headpose_service = ServiceFactory.create_headpose_service()
 
     data = request.json
@@ -173,12 +269,31 @@ def process_video():
         return jsonify({'error': 'video_path is required'}), 400
     
     try:
-        result = headpose_service.video_interest(video_path, frame_skip=10)
+        result = headpose_service.video_interest(video_path, frame_skip=10,
+                                                 start=data.get('start'), end=data.get('end'))
         return jsonify({'result': result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/probe_video', methods=['POST'])
+def probe_video():
+    not_ready = wait_until_ready()
+    if not_ready:
+        return not_ready
+    video_path = request.json.get('video_path')
+    if not video_path:
+        return jsonify({'error': 'video_path is required'}), 400
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return jsonify({'error': f'Failed to open video {video_path}'}), 500
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    return jsonify({'duration': frames / fps if fps else None, 'fps': fps})
+
 
 if __name__ == '__main__':
+    start_warmup()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -62,7 +62,8 @@ def read_me(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str =payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") is not None:
+            # scoped media tokens (see app/media/routes.py) are only good for the media routes
             raise HTTPException(status_code=400, detail="Invalid authentication")
         return {"username": username}
     except Exception:
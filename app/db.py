@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, JSON, Float, LargeBinary, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -29,12 +29,45 @@ class MediaFile(Base):
     filepath = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    # метаданные из ffprobe (None, если файл ещё не пробили или это не видео)
+    duration = Column(Float, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+
+    # keyset-пагинация списка файлов идёт по (uploaded_at, id) в пределах пользователя
+    __table_args__ = (Index("ix_media_files_user_uploaded", "user_id", "uploaded_at", "id"),)
 
 class MediaAnalysis(Base):
     __tablename__ = "media_analyses"
     id = Column(Integer, primary_key=True)
     file_id = Column(Integer, ForeignKey("media_files.id"), unique=True)
-    series = Column(JSON)
-    # можно добавить avg, min, max как отдельные колонки для быстрых запросов
+    series = Column(JSON, nullable=True)  # старый формат, только для уже сохранённых анализов
+    series_blob = Column(LargeBinary, nullable=True)  # packed float32, см. app/media/series.py
+    # сводка для списка файлов, чтобы не распаковывать series
+    point_count = Column(Integer, nullable=True)
+    value_avg = Column(Float, nullable=True)
+    value_min = Column(Float, nullable=True)
+    value_max = Column(Float, nullable=True)
+    engaged_share = Column(Float, nullable=True)  # доля точек с интересом >= 0.7
+
+
+def _upgrade_existing_tables():
+    """create_all does not alter existing tables, so add new nullable columns and indexes by hand."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _upgrade_existing_tables()
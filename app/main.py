@@ -3,6 +3,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, RedirectResponse, Response
 import os
 from app.db import init_db
+from app.media.processing import backfill_summaries
 from app.auth.routes import router as auth_router
 from app.media.routes import router as media_router
 from uuid import uuid4
@@ -12,6 +13,7 @@ app = FastAPI()
 @app.on_event("startup")
 def startup():
     init_db()
+    backfill_summaries()
 
 BOOT_ID = str(uuid4())
 
@@ -0,0 +1,239 @@
+"""Background scheduler for bulk analysis of a user's library.
+
+Files are queued cheapest-first by estimated cost (duration x resolution) and
+run on a small pool of worker threads. Bulk work yields to interactive
+/files/{id}/analyze calls: a worker will not start a new file while an
+interactive analysis is in flight, and the total bulk throughput is capped
+both by concurrency and by files started per minute.
+
+The queue, the caps and the interactive hold-off all live in process memory.
+Each uvicorn worker or API pod therefore runs its own scheduler and enforces
+its own caps. With N API processes the real bulk load on main-service is up to
+N times BULK_MAX_CONCURRENCY, and a process only yields to interactive calls
+that it is serving itself. Set the caps with this in mind, or run bulk
+submissions against a single API process.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from uuid import uuid4
+
+import requests
+
+from app.db import SessionLocal, MediaFile, User, MediaAnalysis
+from app.media.processing import request_series, store_series, estimate_cost, apply_probe
+
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "1"))
+BULK_MAX_PER_MINUTE = int(os.getenv("BULK_MAX_PER_MINUTE", "6"))
+BULK_ANALYSIS_TIMEOUT = int(os.getenv("BULK_ANALYSIS_TIMEOUT", "3600"))
+MAX_KEPT_JOBS = 100
+
+
+class BulkJob:
+    def __init__(self, user_id, costs, skipped):
+        self.id = uuid4().hex
+        self.user_id = user_id
+        self.created_at = time.time()
+        self.costs = costs
+        self.skipped = list(skipped)
+        self.probing = set()
+        self.pending = set(costs)
+        self.running = set()
+        self.done = []
+        self.failed = {}
+
+    def progress(self):
+        """Snapshot of the job; call with the scheduler lock held (BulkScheduler.progress does)."""
+        cost_total = sum(self.costs.values())
+        cost_done = sum(self.costs[f] for f in itertools.chain(self.done, self.failed))
+        finished = not self.probing and not self.pending and not self.running
+        return {
+            "job_id": self.id,
+            "status": "finished" if finished else "running",
+            "total": len(self.costs) + len(self.skipped),
+            "skipped": len(self.skipped),
+            "probing": len(self.probing),
+            "pending": len(self.pending),
+            "running": len(self.running),
+            "done": len(self.done),
+            "failed": len(self.failed),
+            "errors": {str(k): v for k, v in self.failed.items()},
+            "cost_total": cost_total,
+            "cost_done": cost_done,
+            "percent": round(100.0 * cost_done / cost_total, 1) if cost_total else 100.0,
+        }
+
+
+class BulkScheduler:
+    def __init__(self, max_concurrency=BULK_MAX_CONCURRENCY, max_per_minute=BULK_MAX_PER_MINUTE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_minute = max_per_minute
+        self.jobs = OrderedDict()
+        self._queue = []
+        self._seq = itertools.count()
+        self._started = []
+        self._interactive = 0
+        self._cond = threading.Condition()
+        self._workers = []
+
+    @contextmanager
+    def interactive(self):
+        """Mark an interactive analysis as in flight so bulk workers hold off."""
+        with self._cond:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                self._cond.notify_all()
+
+    def submit(self, user_id, files):
+        """Queue MediaFile rows for analysis; files with a stored analysis are skipped."""
+        db = SessionLocal()
+        try:
+            ids = [f.id for f in files]
+            analysed = {
+                row.file_id for row in
+                db.query(MediaAnalysis.file_id).filter(MediaAnalysis.file_id.in_(ids)).all()
+            } if ids else set()
+        finally:
+            db.close()
+
+        todo = [f for f in files if f.id not in analysed]
+        costs = {f.id: estimate_cost(f) for f in todo if f.duration is not None}
+        # older uploads were never probed; ffprobe can take seconds per file, so it runs on a thread
+        unprobed = [f.id for f in todo if f.duration is None]
+        job = BulkJob(user_id, costs, skipped=[i for i in ids if i in analysed])
+        job.probing.update(unprobed)
+        with self._cond:
+            self.jobs[job.id] = job
+            while len(self.jobs) > MAX_KEPT_JOBS:
+                self.jobs.popitem(last=False)
+            for file_id, cost in costs.items():
+                heapq.heappush(self._queue, (cost, next(self._seq), job, file_id))
+            self._ensure_workers()
+            self._cond.notify_all()
+        if unprobed:
+            threading.Thread(target=self._probe_and_queue, args=(job, unprobed),
+                             name="bulk-probe", daemon=True).start()
+        logging.info("Bulk job %s: %d queued, %d probing, %d skipped",
+                     job.id, len(costs), len(unprobed), len(job.skipped))
+        return job
+
+    def _probe_and_queue(self, job, file_ids):
+        db = SessionLocal()
+        try:
+            for file_id in file_ids:
+                media = db.query(MediaFile).filter(MediaFile.id == file_id).first()
+                cost = 0.0
+                if media:
+                    apply_probe(media)
+                    db.commit()
+                    cost = estimate_cost(media)
+                with self._cond:
+                    job.probing.discard(file_id)
+                    job.costs[file_id] = cost
+                    job.pending.add(file_id)
+                    heapq.heappush(self._queue, (cost, next(self._seq), job, file_id))
+                    self._cond.notify_all()
+        except Exception:
+            db.rollback()
+            logging.exception("Probing failed for bulk job %s", job.id)
+            with self._cond:
+                for file_id in list(job.probing):
+                    job.probing.discard(file_id)
+                    job.costs[file_id] = 0.0
+                    job.failed[file_id] = "Probing failed"
+        finally:
+            db.close()
+
+    def progress(self, job_id, user_id):
+        """Progress of a job owned by user_id, or None; built under the lock workers update it with."""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if not job or job.user_id != user_id:
+                return None
+            return job.progress()
+
+    def _ensure_workers(self):
+        # workers stay resident and sleep on _cond while the queue is empty, so a worker
+        # counted here can never be on its way out when new items arrive
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(target=self._run, name="bulk-analysis", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _rate_wait(self):
+        """Seconds until the per-minute cap allows another start (0 if it does now)."""
+        if self.max_per_minute <= 0:
+            return 0
+        now = time.monotonic()
+        self._started = [t for t in self._started if now - t < 60]
+        if len(self._started) < self.max_per_minute:
+            return 0
+        return 60 - (now - self._started[0])
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                wait = self._rate_wait()
+                if self._interactive == 0 and wait == 0:
+                    break
+                self._cond.wait(timeout=wait or 1.0)
+            _, _, job, file_id = heapq.heappop(self._queue)
+            self._started.append(time.monotonic())
+            job.pending.discard(file_id)
+            job.running.add(file_id)
+            return job, file_id
+
+    def _run(self):
+        while True:
+            job, file_id = self._next()
+            error = self._analyze(file_id)
+            with self._cond:
+                job.running.discard(file_id)
+                if error is None:
+                    job.done.append(file_id)
+                else:
+                    job.failed[file_id] = error
+
+    def _analyze(self, file_id):
+        """Run one file through main-service and store the result; return an error string or None."""
+        db = SessionLocal()
+        try:
+            if db.query(MediaAnalysis).filter(MediaAnalysis.file_id == file_id).first():
+                return None
+            row = db.query(MediaFile, User).join(User, MediaFile.user_id == User.id) \
+                .filter(MediaFile.id == file_id).first()
+            if not row:
+                return "File not found"
+            media, user_obj = row
+            if not user_obj.audio_sample_path:
+                return "Speaker sample is not uploaded"
+            blob = request_series(media.filepath, user_obj.audio_sample_path,
+                                  timeout=BULK_ANALYSIS_TIMEOUT, duration=media.duration)
+            store_series(db, file_id, blob)
+            logging.info("Bulk analysed file_id=%s size=%d bytes", file_id, len(blob))
+            return None
+        except requests.RequestException as e:
+            logging.warning("Bulk analysis failed for file_id=%s: %s", file_id, e)
+            return f"Ошибка при вызове main-service: {e}"
+        except Exception as e:
+            db.rollback()
+            logging.exception("Unexpected error during bulk analysis of file_id=%s", file_id)
+            return str(e)
+        finally:
+            db.close()
+
+
+scheduler = BulkScheduler()
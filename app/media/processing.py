@@ -1 +1,292 @@
-##useless now
\ No newline at end of file
+import bisect
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from sqlalchemy.exc import IntegrityError
+
+from app.db import SessionLocal, MediaFile, MediaAnalysis
+from app.media.series import SERIES_MAGIC, points_to_blob, unpack_series
+
+MAIN_SERVICE_URL = os.getenv("MAIN_SERVICE_URL", "http://localhost:5000/process")  # или localhost / host.docker.internal
+SHARED_PREFIX = "/shared/"
+# main-service режет видео на сегменты и при нехватке реплик гоняет их волнами, поэтому ждём долго;
+# сколько ждём, уходит в запрос, и main-service бросает сегменты, не начатые к этому сроку
+ANALYSIS_TIMEOUT = int(os.getenv("ANALYSIS_TIMEOUT", "3600"))
+
+ENGAGED_THRESHOLD = 0.7  # порог «заинтересованности», как линия 70% на графике
+
+THUMB_INTERVAL = int(os.getenv("THUMB_INTERVAL", "10"))  # секунд между превью
+THUMB_WIDTH = 160
+THUMBS_PER_TILE = 20  # превью склеиваются в горизонтальные полосы по THUMBS_PER_TILE штук
+
+# ffmpeg при загрузке идёт в своём пуле, а не в threadpool Starlette, которым пользуются sync-эндпоинты
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+_ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+# file_id -> Future of a keyframe index build in flight, so concurrent /seek calls share one scan
+_keyframe_builds = {}
+_keyframe_lock = threading.Lock()
+
+
+def probe_media(filepath):
+    """Return duration/width/height of the first video stream via ffprobe, or {} if probing fails."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "json",
+        str(filepath),
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True, timeout=30).stdout
+        info = json.loads(out)
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        logging.warning("ffprobe failed for %s: %s", filepath, e)
+        return {}
+
+    streams = info.get("streams") or [{}]
+    duration = (info.get("format") or {}).get("duration")
+    return {
+        "duration": float(duration) if duration else None,
+        "width": streams[0].get("width"),
+        "height": streams[0].get("height"),
+    }
+
+
+def apply_probe(media):
+    """Fill the probe columns of a MediaFile in place; the caller commits."""
+    meta = probe_media(media.filepath)
+    media.duration = meta.get("duration")
+    media.width = meta.get("width")
+    media.height = meta.get("height")
+
+
+def estimate_cost(media):
+    """Rough analysis cost: seconds of video times pixels per frame.
+
+    Falls back to the file size when the file could not be probed, so unprobed
+    files still sort sensibly against each other.
+    """
+    if media.duration and media.width and media.height:
+        return media.duration * media.width * media.height
+    try:
+        return float(Path(media.filepath).stat().st_size)
+    except OSError:
+        return 0.0
+
+
+def derived_dir(media):
+    """Directory for files derived from an upload (thumbnail strips, keyframe index)."""
+    return Path(media.filepath).parent / "derived" / str(media.id)
+
+
+def build_keyframe_index(filepath, out_path):
+    """Write [[time, byte offset], ...] of every video keyframe, read from packet flags without decoding."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,pos,flags",
+        "-of", "csv=p=0",
+        str(filepath),
+    ]
+    out = subprocess.run(cmd, capture_output=True, check=True, text=True, timeout=600).stdout
+    index = []
+    for line in out.splitlines():
+        parts = line.split(",")
+        if len(parts) < 3 or not parts[2].startswith("K") or "N/A" in parts[:2]:
+            continue
+        index.append([float(parts[0]), int(parts[1])])
+    index.sort()
+    # write to a unique temp file then rename, so a reader never sees a half-written index
+    with tempfile.NamedTemporaryFile("w", dir=out_path.parent, suffix=".tmp", delete=False) as tmp:
+        json.dump(index, tmp)
+    Path(tmp.name).replace(out_path)
+    return index
+
+
+def build_thumbnails(media, out_dir):
+    """Render one small frame about every THUMB_INTERVAL seconds, tiled into JPEG strips, and a manifest.
+
+    Only keyframes are decoded (-skip_frame nokey), so a preview shows the nearest
+    keyframe rather than the exact instant, at a fraction of a full decode.
+    """
+    height = 2 * round(THUMB_WIDTH * media.height / media.width / 2) if media.width and media.height else 90
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-skip_frame", "nokey",
+        "-threads", "1",
+        "-i", str(media.filepath),
+        "-an",
+        "-vf", f"fps=1/{THUMB_INTERVAL},scale={THUMB_WIDTH}:{height},tile={THUMBS_PER_TILE}x1",
+        "-q:v", "5",
+        str(out_dir / "thumbs_%04d.jpg"),
+    ]
+    subprocess.run(cmd, capture_output=True, check=True, timeout=3600)
+    manifest = {
+        "interval": THUMB_INTERVAL,
+        "per_tile": THUMBS_PER_TILE,
+        "width": THUMB_WIDTH,
+        "height": height,
+        "tiles": len(list(out_dir.glob("thumbs_*.jpg"))),
+    }
+    (out_dir / "thumbnails.json").write_text(json.dumps(manifest))
+    return manifest
+
+
+def submit_ingest(file_id):
+    """Queue prepare_streaming on the ingest pool; returns immediately."""
+    _ingest_executor.submit(prepare_streaming, file_id)
+
+
+def prepare_streaming(file_id):
+    """Ingest step run on the ingest pool: thumbnail strips for a fresh upload."""
+    db = SessionLocal()
+    try:
+        media = db.query(MediaFile).filter(MediaFile.id == file_id).first()
+        if not media or not media.duration:
+            return
+        out_dir = derived_dir(media)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            build_thumbnails(media, out_dir)
+            logging.info("Streaming artifacts ready for file_id=%s", file_id)
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning("Could not build streaming artifacts for file_id=%s: %s", file_id, e)
+    finally:
+        db.close()
+
+
+def remove_derived(media):
+    shutil.rmtree(derived_dir(media), ignore_errors=True)
+
+
+def _build_keyframe_index(file_id, filepath, index_path):
+    index = build_keyframe_index(filepath, index_path)
+    # the file is written, so later calls read it; a failed build stays until a caller collects the error
+    with _keyframe_lock:
+        _keyframe_builds.pop(file_id, None)
+    return index
+
+
+def keyframe_index(media):
+    """Return the keyframe index of a file, or None while it is still being built.
+
+    The index is built by a packet scan on the first request for a file and
+    cached next to the thumbnails. The browser player does not need it, so
+    uploads do not pay for the scan. The scan runs on the ingest pool, one per
+    file however many requests ask for it; a failed build gives [] and is
+    retried on the next request.
+    """
+    index_path = derived_dir(media) / "keyframes.json"
+    if index_path.exists():
+        return json.loads(index_path.read_text())
+    with _keyframe_lock:
+        future = _keyframe_builds.get(media.id)
+        if future is None:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            future = _ingest_executor.submit(_build_keyframe_index, media.id, media.filepath, index_path)
+            _keyframe_builds[media.id] = future
+        if not future.done():
+            return None
+        _keyframe_builds.pop(media.id, None)
+    try:
+        return future.result()
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning("Could not build keyframe index for file_id=%s: %s", media.id, e)
+        return []
+
+
+def seek_offset(index, t):
+    """Return (keyframe time, byte offset) of the last keyframe at or before t, or None if there is none."""
+    if not index:
+        return None
+    i = bisect.bisect_right(index, [t, float("inf")]) - 1
+    return tuple(index[max(i, 0)])
+
+
+def request_series(video_path, sample_path, timeout=ANALYSIS_TIMEOUT, duration=None):
+    """Call main-service and return the interest series in packed binary form.
+
+    Passing the probed duration lets main-service shard the video without probing it again.
+    The timeout goes along too, so main-service stops once this call has given up.
+    """
+    payload = {
+        "video_path": SHARED_PREFIX + os.path.basename(video_path),
+        "sample_path": SHARED_PREFIX + os.path.basename(sample_path),
+        "duration": duration,
+        "timeout": timeout,
+        "format": "binary",
+    }
+    response = requests.post(MAIN_SERVICE_URL, json=payload, timeout=timeout)
+    response.raise_for_status()
+    if response.content.startswith(SERIES_MAGIC):
+        return response.content
+    # main-service без поддержки binary отвечает старым JSON
+    return points_to_blob([
+        {"t": float(t_str), "value": float(value)}
+        for t_str, value in response.json().items()
+    ])
+
+
+def analysis_blob(analysis):
+    """Packed series of a stored analysis, converting rows saved in the old JSON form."""
+    if analysis.series_blob is not None:
+        return analysis.series_blob
+    return points_to_blob(analysis.series or [])
+
+
+def summarize_series(blob):
+    """Summary columns of MediaAnalysis for a packed series.
+
+    An empty series (no faces found) has no avg/min/max but a 0.0 engaged share,
+    so point_count alone tells a summarised row from one that still needs it.
+    """
+    _, values = unpack_series(blob)
+    return {
+        "point_count": len(values),
+        "value_avg": sum(values) / len(values) if values else None,
+        "value_min": min(values) if values else None,
+        "value_max": max(values) if values else None,
+        "engaged_share": sum(1 for v in values if v >= ENGAGED_THRESHOLD) / len(values) if values else 0.0,
+    }
+
+
+def fill_summary(analysis):
+    """Set missing summary columns (and the packed series of old JSON rows) in place; the caller commits."""
+    blob = analysis_blob(analysis)
+    analysis.series_blob = blob
+    for column, value in summarize_series(blob).items():
+        setattr(analysis, column, value)
+
+
+def backfill_summaries():
+    """Fill summary columns of analyses stored before those columns existed."""
+    db = SessionLocal()
+    try:
+        rows = db.query(MediaAnalysis).filter(MediaAnalysis.point_count.is_(None)).all()
+        for analysis in rows:
+            fill_summary(analysis)
+        db.commit()
+        if rows:
+            logging.info("Backfilled summary stats for %d analyses", len(rows))
+    finally:
+        db.close()
+
+
+def store_series(db, file_id, blob):
+    """Persist a packed series with its summary stats; if another request stored it first, keep theirs."""
+    analysis = MediaAnalysis(file_id=file_id, series_blob=blob, **summarize_series(blob))
+    db.add(analysis)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return db.query(MediaAnalysis).filter(MediaAnalysis.file_id == file_id).first()
+    return analysis
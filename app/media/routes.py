@@ -1,10 +1,25 @@
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException
+from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
 import requests
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import tuple_
+from pydantic import BaseModel
 from jose import jwt
 from app.db import SessionLocal, MediaFile, User, MediaAnalysis
+from app.media.processing import (
+    apply_probe, request_series, store_series, analysis_blob,
+    derived_dir, submit_ingest, remove_derived, keyframe_index, seek_offset, fill_summary,
+)
+from app.media.series import SERIES_MEDIA_TYPE, blob_to_points
+from app.media.bulk import scheduler
 import os
+import json
+import base64
+import hashlib
+import mimetypes
+from datetime import datetime, timedelta
 from pathlib import Path
 import logging
 logging.basicConfig(
@@ -14,9 +29,13 @@ logging.basicConfig(
 )
 router = APIRouter()
 oauth2_scheme =OAuth2PasswordBearer(tokenUrl="/auth/token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/auth/token", auto_error=False)
 SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# токены для <video>/<img> идут в URL, поэтому живут недолго и открывают только один файл
+MEDIA_TOKEN_EXPIRE_MINUTES = 10
+MEDIA_TOKEN_SCOPE = "media"
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -25,13 +44,54 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") is not None:
+            # scoped media tokens are only good for the media routes
             raise HTTPException(status_code=400, detail="Invalid authentication")
         return username
     except:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def create_media_token(username, file_id):
+    expire = datetime.utcnow() + timedelta(minutes=MEDIA_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": username, "scope": MEDIA_TOKEN_SCOPE, "file_id": file_id, "exp": expire},
+                      SECRET_KEY, algorithm=ALGORITHM)
+
+
+async def get_media_user(
+        file_id: int,
+        header_token: str | None = Depends(oauth2_scheme_optional),
+        token: str | None = None
+):
+    """Auth for stream/thumbnail routes.
+
+    Takes the normal bearer header, or ?token= with a media token from
+    /files/{file_id}/media-token, since <video> and <img> cannot send headers.
+    The main API token is never accepted in the query string.
+    """
+    if header_token:
+        return await get_current_user(header_token)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("scope") != MEDIA_TOKEN_SCOPE or payload.get("file_id") != file_id or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload["sub"]
+
+
+def get_user_file(db, username, file_id):
+    user_obj = db.query(User).filter(User.username == username).first()
+    if not user_obj:
+        raise HTTPException(status_code=404, detail="User not found")
+    file = db.query(MediaFile).filter(MediaFile.id == file_id, MediaFile.user_id == user_obj.id).first()
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file
+
+
 @router.post("/upload")
 async def upload(
         files: list[UploadFile] = File(...),
@@ -56,8 +116,12 @@ async def upload(
 
             # Create a DB record for the upload
             media = MediaFile(filename=file.filename, filepath=str(filepath), user_id=user_obj.id)
+            # ffprobe blocks for up to 30 s; keep it off the event loop
+            await run_in_threadpool(apply_probe, media)
             db.add(media)
             db.commit()
+            # thumbnails for streaming are built on the ingest pool, outside the request threadpool
+            submit_ingest(media.id)
             results.append({"filename": file.filename, "path": str(filepath)})
         return {"user": user, "results": results}
     finally:
@@ -92,20 +156,113 @@ async def upload(
 
 
 
+def encode_cursor(uploaded_at, file_id):
+    raw = f"{uploaded_at.isoformat()}|{file_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        uploaded_at, file_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(uploaded_at), int(file_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def file_summary_query(db, user_id):
+    # only the summary columns of MediaAnalysis, the series itself is not needed here
+    return db.query(
+        MediaFile.id, MediaFile.filename, MediaFile.uploaded_at, MediaFile.duration,
+        MediaAnalysis.id.label("analysis_id"), MediaAnalysis.point_count,
+        MediaAnalysis.value_avg, MediaAnalysis.value_min, MediaAnalysis.value_max,
+        MediaAnalysis.engaged_share,
+    ).outerjoin(MediaAnalysis, MediaAnalysis.file_id == MediaFile.id) \
+        .filter(MediaFile.user_id == user_id)
+
+
+def file_summary(f):
+    return {
+        "id": f.id,
+        "filename": f.filename,
+        "uploaded_at": f.uploaded_at,
+        "duration": f.duration,
+        "analyzed": f.analysis_id is not None,
+        "stats": {
+            "points": f.point_count,
+            "avg": f.value_avg,
+            "min": f.value_min,
+            "max": f.value_max,
+            "engaged": f.engaged_share,
+        } if f.analysis_id is not None else None,
+    }
+
+
 @router.get("/files")
-async def get_user_files(user: str = Depends(get_current_user)):
+async def get_user_files(
+        request: Request,
+        cursor: str | None = None,
+        limit: int = Query(100, ge=1, le=500),
+        uploaded_from: datetime | None = None,
+        uploaded_to: datetime | None = None,
+        analyzed: bool | None = None,
+        user: str = Depends(get_current_user)
+):
+    """List the user's files newest first, one keyset page at a time.
+
+    Pass next_cursor back as cursor for the following page. Each file carries its
+    analysis status and summary stats. The response has an ETag, and a matching
+    If-None-Match gets a 304.
+    """
     db = SessionLocal()
     try:
         use_obj = db.query(User).filter(User.username == user).first()
         if not use_obj:
             raise HTTPException(status_code=404, detail="User not found")
-        files = db.query(MediaFile).filter(MediaFile.user_id == use_obj.id).all()
-        return {"user": user,
-            "files": [
-                {"id": f.id, "filename": f.filename, "uploaded_at": f.uploaded_at}
-                for f in files
-            ]
-        }
+
+        query = file_summary_query(db, use_obj.id)
+        if uploaded_from:
+            query = query.filter(MediaFile.uploaded_at >= uploaded_from)
+        if uploaded_to:
+            query = query.filter(MediaFile.uploaded_at < uploaded_to)
+        if analyzed is True:
+            query = query.filter(MediaAnalysis.id.isnot(None))
+        elif analyzed is False:
+            query = query.filter(MediaAnalysis.id.is_(None))
+        if cursor:
+            query = query.filter(tuple_(MediaFile.uploaded_at, MediaFile.id) < decode_cursor(cursor))
+        rows = query.order_by(MediaFile.uploaded_at.desc(), MediaFile.id.desc()).limit(limit + 1).all()
+
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1].uploaded_at, page[-1].id) if len(rows) > limit else None
+        body = jsonable_encoder({
+            "user": user,
+            "files": [file_summary(f) for f in page],
+            "next_cursor": next_cursor,
+        })
+
+        content = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        # no-cache: the browser keeps the list but revalidates it with If-None-Match every time
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return Response(content=content, media_type="application/json", headers=headers)
+    finally:
+        db.close()
+
+
+@router.get("/files/{file_id}")
+async def get_user_file_summary(file_id: int, user: str = Depends(get_current_user)):
+    """One file with its analysis status and summary stats, same shape as a /files entry."""
+    db = SessionLocal()
+    try:
+        user_obj = db.query(User).filter(User.username == user).first()
+        if not user_obj:
+            raise HTTPException(status_code=404, detail="User not found")
+        row = file_summary_query(db, user_obj.id).filter(MediaFile.id == file_id).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="File not found")
+        return file_summary(row)
     finally:
         db.close()
 
@@ -126,6 +283,8 @@ async def delete_file(file_id: int, user: str = Depends(get_current_user)):
         if filepath.exists():
             filepath.unlink()
 
+        remove_derived(file)
+        db.query(MediaAnalysis).filter(MediaAnalysis.file_id == file.id).delete()
         db.delete(file)
         db.commit()
         return {"msg": "File deleted"}
@@ -154,8 +313,101 @@ async def download_file(file_id: int, user: str = Depends(get_current_user)):
         db.close()
 
 
+@router.post("/files/{file_id}/media-token")
+async def issue_media_token(file_id: int, user: str = Depends(get_current_user)):
+    """Short-lived token for ?token= on this file's stream and thumbnail URLs."""
+    db = SessionLocal()
+    try:
+        get_user_file(db, user, file_id)
+        return {"token": create_media_token(user, file_id), "expires_in": MEDIA_TOKEN_EXPIRE_MINUTES * 60}
+    finally:
+        db.close()
+
+
+@router.get("/files/{file_id}/stream")
+async def stream_file(file_id: int, user: str = Depends(get_media_user)):
+    """Serve the file inline for a <video> element.
+
+    Starlette's FileResponse answers Range requests with 206 Partial Content, so
+    the browser fetches only the bytes around the seek position.
+    """
+    db = SessionLocal()
+    try:
+        file = get_user_file(db, user, file_id)
+        filepath = Path(file.filepath)
+        if not filepath.exists():
+            raise HTTPException(status_code=404, detail="File not found")
+        media_type = mimetypes.guess_type(file.filename)[0] or "application/octet-stream"
+        return FileResponse(path=str(filepath), media_type=media_type, filename=file.filename,
+                            content_disposition_type="inline")
+    finally:
+        db.close()
+
+
+@router.get("/files/{file_id}/seek")
+async def seek_file(file_id: int, t: float = Query(..., ge=0), user: str = Depends(get_media_user)):
+    """Map a time in seconds to the byte offset of the keyframe at or before it.
+
+    For clients that issue their own Range requests (download tools, custom
+    players). The built-in <video> player seeks with currentTime and lets the
+    browser map time to bytes from the container index, so it does not call this.
+    The first call for a file starts building the index and gets 202 until it is ready.
+    """
+    db = SessionLocal()
+    try:
+        file = get_user_file(db, user, file_id)
+        # reading a cached index of a long file is not free; keep it off the event loop
+        index = await run_in_threadpool(keyframe_index, file)
+        if index is None:
+            return JSONResponse(status_code=202, content={"detail": "Keyframe index is being built"},
+                                headers={"Retry-After": "5"})
+        found = seek_offset(index, t)
+        if found is None:
+            raise HTTPException(status_code=404, detail="No keyframe index for this file")
+        keyframe_t, offset = found
+        return {"t": t, "keyframe_t": keyframe_t, "offset": offset}
+    finally:
+        db.close()
+
+
+@router.get("/files/{file_id}/thumbnails")
+async def get_thumbnails(file_id: int, user: str = Depends(get_media_user)):
+    """Manifest of the thumbnail strips: strip n covers [n, n+1) * interval * per_tile seconds."""
+    db = SessionLocal()
+    try:
+        file = get_user_file(db, user, file_id)
+        manifest_path = derived_dir(file) / "thumbnails.json"
+        if not manifest_path.exists():
+            raise HTTPException(status_code=404, detail="Thumbnails are not ready")
+        return json.loads(manifest_path.read_text())
+    finally:
+        db.close()
+
+
+@router.get("/files/{file_id}/thumbnails/{tile}")
+async def get_thumbnail_tile(file_id: int, tile: int, user: str = Depends(get_media_user)):
+    db = SessionLocal()
+    try:
+        file = get_user_file(db, user, file_id)
+        # ffmpeg numbers output images from 1
+        tile_path = derived_dir(file) / f"thumbs_{tile + 1:04d}.jpg"
+        if tile < 0 or not tile_path.exists():
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+        return FileResponse(path=str(tile_path), media_type="image/jpeg",
+                            headers={"Cache-Control": "private, max-age=86400"})
+    finally:
+        db.close()
+
+
+def series_response(blob, format):
+    if format == "binary":
+        return Response(content=blob, media_type=SERIES_MEDIA_TYPE)
+    return {"series": blob_to_points(blob)}
+
+
 @router.get("/files/{file_id}/analyze")
-async def analyze_media_file(file_id: int, user: str = Depends(get_current_user)):
+async def analyze_media_file(file_id: int, format: str = "json", user: str = Depends(get_current_user)):
+    """Return the interest series; format=binary gives the packed float32 form (see app/media/series.py)."""
     db = SessionLocal()
     try:
         user_obj = db.query(User).filter(User.username == user).first()
@@ -171,75 +423,29 @@ async def analyze_media_file(file_id: int, user: str = Depends(get_current_user)
 
         if existing_analysis:
             logging.info("Returning cached analysis for file_id=%s", file_id)
-            return {"series": existing_analysis.series}
+            if existing_analysis.point_count is None:
+                fill_summary(existing_analysis)
+                db.commit()
+            return series_response(analysis_blob(existing_analysis), format)
 
         filepath = Path(file.filepath)
         if not filepath.exists():
             raise HTTPException(status_code=404, detail="Stored file is missing")
 
-        filename = os.path.basename(filepath)
-        logging.info(filename)
-        logging.info(user_obj.audio_sample_path)
-        #result = analyze_file(file.filepath)
-        url = "http://localhost:5000/process" # или localhost / host.docker.internal
-        speakerGOVORITTTT = os.path.basename(user_obj.audio_sample_path)
-        logging.info(speakerGOVORITTTT)
-        payload = {
-            "video_path": "/shared/"+filename,
-            "sample_path": "/shared/"+speakerGOVORITTTT
-        }
+        if not user_obj.audio_sample_path:
+            raise HTTPException(status_code=400, detail="Speaker sample is not uploaded")
 
         try:
-            response = requests.post(url, json=payload, timeout=60)
-            output_list = {"series": [
-                {"t": float(t_str), "value": float(value)}  # или int(value), если всегда целые
-                for t_str, value in response.json().items()
-            ]}
-            response.raise_for_status()
-            logging.info(output_list)
-            print(output_list)
-            print(output_list)
-            return output_list
+            with scheduler.interactive():
+                # main-service can take minutes; block a threadpool worker, not the event loop
+                blob = await run_in_threadpool(request_series, str(filepath), user_obj.audio_sample_path,
+                                               duration=file.duration)
         except requests.RequestException as e:
             raise HTTPException(status_code=500, detail=f"Ошибка при вызове main-service: {str(e)}")
-        # result = None # заменить
-        #
-        # logging.info("")
-        # if not isinstance(result, dict) or "series" not in result:
-        #     logging.warning("analyze_file returned invalid result for file_id=%s", file_id)
-        #     raise HTTPException(status_code=500, detail="Invalid analysis result")
-        #
-        # series = result["series"]
-        # if not isinstance(series, list):
-        #     raise HTTPException(status_code=500, detail="Series must be a list")
-        #
-        # new_analysis = MediaAnalysis(
-        #     file_id=file_id,
-        #     series=series
-        # )
-        #
-        # db.add(new_analysis)
-        # db.commit()
-        # db.refresh(new_analysis)
-        #
-        # try:
-        #     if series:
-        #         vals = [float(p.get("value", 0.0)) for p in series]
-        #         times = [float(p.get("t", 0.0)) for p in series]
-        #         avg = sum(vals) / len(vals)
-        #         vmin, vmax = min(vals), max(vals)
-        #         tmin, tmax = min(times), max(times)
-        #         logging.info(
-        #             "Analyzed & cached file_id=%s len=%d avg=%.4f min=%.4f max=%.4f t=[%.3f..%.3f]",
-        #             file_id, len(series), avg, vmin, vmax, tmin, tmax
-        #         )
-        #         logging.info("Sample points: %s", series[:5])
-        #     else:
-        #         logging.warning("Empty series for file_id=%s", file_id)
-        # except Exception as e:
-        #     logging.exception("Failed to log analysis stats: %s", e)
-        #
-        # return result
+
+        store_series(db, file_id, blob)
+        logging.info("Analyzed & cached file_id=%s size=%d bytes", file_id, len(blob))
+        return series_response(blob, format)
 
     except HTTPException:
         db.rollback()
@@ -249,4 +455,55 @@ async def analyze_media_file(file_id: int, user: str = Depends(get_current_user)
         logging.exception("Unexpected error during analysis: %s", e)
         raise HTTPException(status_code=500, detail="Analysis failed")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+class BulkAnalyzeRequest(BaseModel):
+    file_ids: list[int] | None = None
+    all_unanalyzed: bool = False
+
+
+@router.post("/analyze/bulk")
+async def bulk_analyze(body: BulkAnalyzeRequest, user: str = Depends(get_current_user)):
+    """Queue many files for background analysis, cheapest first."""
+    if not body.all_unanalyzed and not body.file_ids:
+        raise HTTPException(status_code=400, detail="file_ids or all_unanalyzed is required")
+    db = SessionLocal()
+    try:
+        user_obj = db.query(User).filter(User.username == user).first()
+        if not user_obj:
+            raise HTTPException(status_code=404, detail="User not found")
+        if not user_obj.audio_sample_path:
+            raise HTTPException(status_code=400, detail="Speaker sample is not uploaded")
+
+        query = db.query(MediaFile).filter(MediaFile.user_id == user_obj.id)
+        if body.all_unanalyzed:
+            query = query.outerjoin(MediaAnalysis, MediaAnalysis.file_id == MediaFile.id) \
+                .filter(MediaAnalysis.id.is_(None))
+        if body.file_ids:
+            query = query.filter(MediaFile.id.in_(body.file_ids))
+        files = query.all()
+
+        if body.file_ids and not body.all_unanalyzed:
+            missing = set(body.file_ids) - {f.id for f in files}
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Files not found: {sorted(missing)}")
+
+        job = scheduler.submit(user_obj.id, files)
+        return scheduler.progress(job.id, user_obj.id)
+    finally:
+        db.close()
+
+
+@router.get("/analyze/bulk/{job_id}")
+async def bulk_analyze_progress(job_id: str, user: str = Depends(get_current_user)):
+    db = SessionLocal()
+    try:
+        user_obj = db.query(User).filter(User.username == user).first()
+        if not user_obj:
+            raise HTTPException(status_code=404, detail="User not found")
+        progress = scheduler.progress(job_id, user_obj.id)
+        if progress is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return progress
+    finally:
+        db.close()
@@ -0,0 +1,50 @@
+"""Packed binary form of an interest series.
+
+Layout (little-endian): b"CMS1", uint32 point count n, n float32 times,
+then n float32 values. The front end reads it straight into two
+Float32Arrays; see decodeSeries in static/script.js.
+"""
+import struct
+import sys
+from array import array
+
+SERIES_MAGIC = b"CMS1"
+SERIES_MEDIA_TYPE = "application/vnd.classmood.series"
+_HEADER = struct.Struct("<4sI")
+
+
+def pack_series(times, values):
+    times = array("f", times)
+    values = array("f", values)
+    if len(times) != len(values):
+        raise ValueError("times and values must have the same length")
+    if sys.byteorder != "little":
+        times.byteswap()
+        values.byteswap()
+    return _HEADER.pack(SERIES_MAGIC, len(times)) + times.tobytes() + values.tobytes()
+
+
+def unpack_series(blob):
+    """Return (times, values) as float32 arrays."""
+    magic, n = _HEADER.unpack_from(blob)
+    if magic != SERIES_MAGIC or len(blob) != _HEADER.size + 8 * n:
+        raise ValueError("Not a packed series")
+    times = array("f")
+    values = array("f")
+    times.frombytes(blob[_HEADER.size:_HEADER.size + 4 * n])
+    values.frombytes(blob[_HEADER.size + 4 * n:])
+    if sys.byteorder != "little":
+        times.byteswap()
+        values.byteswap()
+    return times, values
+
+
+def points_to_blob(points):
+    """Pack the legacy [{"t": ..., "value": ...}] form."""
+    return pack_series([p["t"] for p in points], [p["value"] for p in points])
+
+
+def blob_to_points(blob):
+    times, values = unpack_series(blob)
+    # float32 -> float64 leaves digits like 12.345000267; trim them for the JSON form
+    return [{"t": round(t, 3), "value": round(v, 6)} for t, v in zip(times, values)]
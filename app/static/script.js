@@ -86,6 +86,33 @@ async function uploadAudio() {
 
 
 
+// Decode the packed series returned by /analyze?format=binary:
+// "CMS1", uint32 count n, then n float32 times and n float32 values (little-endian).
+function decodeSeries(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'CMS1') throw new Error('Unexpected series format');
+    const n = view.getUint32(4, true);
+    // Float32Array uses platform byte order, which is little-endian in every browser we target
+    return {
+        t: new Float32Array(buffer, 8, n),
+        value: new Float32Array(buffer, 8 + 4 * n, n),
+    };
+}
+
+// Fetch the analysis of a file in the packed binary form and decode it.
+async function fetchSeries(id) {
+    const token = localStorage.getItem('token');
+    const res = await fetch(`/media/files/${id}/analyze?format=binary`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+    });
+    if (!res.ok) {
+        const data = await res.json().catch(() => ({}));
+        throw new Error(data.detail || 'Analysis failed');
+    }
+    return decodeSeries(await res.arrayBuffer());
+}
+
 // Analyze a selected file and render the engagement chart below.
 async function analyzeFile(id) {
     const token = localStorage.getItem('token');
@@ -96,38 +123,34 @@ async function analyzeFile(id) {
         return;
     }
     try {
-        const res = await fetch(`/media/files/${id}/analyze`, {
+        const res = await fetch(`/media/files/${id}/analyze?format=binary`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
-        const data = await res.json();
-        // Debug: see server payload if chart not showing
-        if (window && window.console) {
-            console.debug('analyze response', data);
-            if (Array.isArray(data?.series)) {
-                // Tabular view in browser console
-                console.log(data.series)
-                console.table(data.series.map(p => ({ t: Number(p.t), value: Number(p.value) })));
-                // Summary
-                const vals = data.series.map(p => Number(p.value) || 0);
-                const avg = vals.reduce((a,b)=>a+b,0) / Math.max(1, vals.length);
-                console.log(`Series length: ${vals.length}, avg value: ${avg.toFixed(3)}`);
-            }
-        }
         if (!res.ok) {
+            const data = await res.json().catch(() => ({}));
             if (errEl) errEl.textContent = data.detail || 'Analyze failed';
             return;
         }
-        if (!data || !Array.isArray(data.series)) {
+        let decoded;
+        try {
+            decoded = decodeSeries(await res.arrayBuffer());
+        } catch (e) {
             if (errEl) errEl.textContent = 'Unexpected analyze response';
             return;
         }
-        renderChart(data.series);
+        // Debug: see server payload if chart not showing
+        if (window && window.console) {
+            const avg = decoded.value.reduce((a, b) => a + b, 0) / Math.max(1, decoded.value.length);
+            console.log(`Series length: ${decoded.value.length}, avg value: ${avg.toFixed(3)}`);
+        }
+        renderChart(decoded);
     } catch (e) {
         if (errEl) errEl.textContent = 'Connection error';
     }
 }
 
 // Render a simple line chart of value over time on a canvas with id "engagement-chart".
+// series is a decoded series: {t, value} Float32Arrays with t sorted ascending.
 function renderChart(series, label = 'File 1') {
   const canvas = document.getElementById('engagement-chart');
   if (!canvas) return;
@@ -137,7 +160,7 @@ function renderChart(series, label = 'File 1') {
 
   ctx.clearRect(0, 0, w, h);
 
-  if (!series || series.length === 0) {
+  if (!series || series.t.length === 0) {
     ctx.fillStyle = '#666';
     ctx.font = '16px sans-serif';
     ctx.textAlign = 'center';
@@ -145,11 +168,11 @@ function renderChart(series, label = 'File 1') {
     return;
   }
 
-  // Сбор времён и значений
-  const times = series.map(p => Number(p.t) || 0);
-  const values = series.map(p => Number(p.value) || 0);
-  const tMin = Math.min(...times);
-  const tMax = Math.max(...times);
+  // Времена отсортированы, поэтому границы — первый и последний элементы
+  const times = series.t;
+  const values = series.value;
+  const tMin = times[0];
+  const tMax = times[times.length - 1];
   const vMin = 0;
   const vMax = 1;
   const actualDuration = tMax - tMin;
@@ -220,6 +243,8 @@ function renderChart(series, label = 'File 1') {
     const relativeTime = t - tMin;
     return padL + (relativeTime / Math.max(1e-9, actualDuration)) * plotW;
   };
+  // Remember the time axis so attachVideoSync can map a click on the chart back to a time
+  canvas.timeAxis = { padL, plotW, tMin, duration: actualDuration };
   const y = v => padT + (1 - (v - vMin) / Math.max(1e-9, (vMax - vMin))) * plotH;
 
   // === Рисуем линию по ВСЕМ точкам ===
@@ -289,23 +314,188 @@ function renderChart(series, label = 'File 1') {
   ctx.font = '12px sans-serif';
   ctx.fillText(label, legendX + 25, legendY + 5);
 }
-// Load the current user's file list and render simple rows with a delete button.
-// This function is called after a successful upload and on page load.
-async function loadUserFiles() {
+// Files seen on any loaded page, by id, so names can be looked up without another request.
+const knownFiles = new Map();
+
+// Fetch one page of the current user's file list; pass next_cursor back for the following page.
+// The server sends an ETag with Cache-Control: no-cache, so the browser revalidates the page
+// with If-None-Match and an unchanged page comes back as an empty 304.
+async function fetchUserFilesPage(cursor = null, filters = {}) {
     const token = localStorage.getItem('token');
-    const res = await fetch('/media/files', {
+    const query = new URLSearchParams(filters);
+    if (cursor) query.set('cursor', cursor);
+    const res = await fetch(`/media/files?${query}`, {
         headers: { 'Authorization': `Bearer ${token}` }
     });
+    if (!res.ok) return { ok: false, files: [], next_cursor: null };
     const data = await res.json();
+    data.files.forEach(f => knownFiles.set(f.id, f));
+    return { ok: true, files: data.files, next_cursor: data.next_cursor };
+}
+
+// One file with its analysis status and summary stats.
+async function fetchFileSummary(id) {
+    const token = localStorage.getItem('token');
+    const res = await fetch(`/media/files/${id}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+    });
+    if (!res.ok) return null;
+    const file = await res.json();
+    knownFiles.set(file.id, file);
+    return file;
+}
+
+// Replace or add the "load more" button at the end of a file list.
+// loaderName is the global function called with the cursor of the next page.
+function renderLoadMore(containerEl, nextCursor, loaderName) {
+    containerEl.querySelectorAll('.load-more, .load-more-error').forEach(el => el.remove());
+    if (!nextCursor) return;
+    containerEl.insertAdjacentHTML('beforeend',
+        `<button class="outline load-more" onclick="${loaderName}('${nextCursor}')">Загрузить ещё</button>`);
+}
+
+// A "load more" request failed: keep the pages already shown and the button, so it can be retried.
+function showLoadMoreError(containerEl) {
+    const old = containerEl.querySelector('.load-more-error');
+    if (old) old.remove();
+    const button = containerEl.querySelector('.load-more');
+    const html = '<p class="load-more-error" style="color: red;">Не удалось загрузить следующие файлы, попробуйте ещё раз</p>';
+    if (button) button.insertAdjacentHTML('beforebegin', html);
+    else containerEl.insertAdjacentHTML('beforeend', html);
+}
+
+// Map a mouse event on the chart canvas to a time in seconds, or null outside the plot.
+function chartTimeAt(canvas, event) {
+    const axis = canvas.timeAxis;
+    if (!axis) return null;
+    const px = event.offsetX * (canvas.width / canvas.clientWidth);
+    const rel = (px - axis.padL) / axis.plotW;
+    if (rel < 0 || rel > 1) return null;
+    return axis.tMin + rel * axis.duration;
+}
+
+// Short-lived token scoped to one file, for <video>/<img> URLs that cannot carry the Authorization header.
+async function fetchMediaToken(fileId) {
+    const token = localStorage.getItem('token');
+    const res = await fetch(`/media/files/${fileId}/media-token`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${token}` }
+    });
+    return res.ok ? await res.json() : null;
+}
+
+let mediaTokenTimer = null;
+
+// Play the analysed file under the chart: a click on the chart seeks the video,
+// hovering shows a thumbnail from the strips generated at upload.
+// The video is streamed with HTTP Range requests, so a seek only downloads the bytes around t.
+async function attachVideoSync(fileId) {
+    const token = localStorage.getItem('token');
+    const canvas = document.getElementById('engagement-chart');
+    const section = document.getElementById('video-preview-section');
+    const video = document.getElementById('video-fragment');
+    const preview = document.getElementById('chart-preview');
+    if (!canvas || !section || !video) return;
+
+    let media = await fetchMediaToken(fileId);
+    if (!media) return;
+    const auth = () => `token=${encodeURIComponent(media.token)}`;
+    video.src = `/media/files/${fileId}/stream?${auth()}`;
+    section.classList.remove('hidden');
+
+    // Renew the token before it expires; new thumbnail URLs pick it up directly
+    clearInterval(mediaTokenTimer);
+    mediaTokenTimer = setInterval(async () => {
+        const next = await fetchMediaToken(fileId);
+        if (next) media = next;
+    }, Math.max(30, media.expires_in - 60) * 1000);
+    // The <video> keeps its original URL, so once that token expires its next Range request fails:
+    // switch to the current token and resume at the same position
+    let lastRetry = 0;
+    video.onerror = () => {
+        if (Date.now() - lastRetry < 5000) return;
+        lastRetry = Date.now();
+        const at = video.currentTime;
+        video.src = `/media/files/${fileId}/stream?${auth()}`;
+        video.currentTime = at;
+    };
+
+    let thumbs = null;
+    try {
+        const res = await fetch(`/media/files/${fileId}/thumbnails`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (res.ok) thumbs = await res.json();
+    } catch (e) {
+        // Thumbnails are optional; the chart still seeks without them
+    }
+
+    canvas.onclick = event => {
+        const t = chartTimeAt(canvas, event);
+        if (t === null) return;
+        video.currentTime = t;
+        video.play().catch(() => {});
+    };
+    canvas.onmouseleave = () => { if (preview) preview.classList.add('hidden'); };
+    canvas.onmousemove = event => {
+        const t = chartTimeAt(canvas, event);
+        const n = t === null || !thumbs ? -1 : Math.floor(t / thumbs.interval);
+        const tile = Math.floor(n / (thumbs ? thumbs.per_tile : 1));
+        if (!preview || n < 0 || tile >= thumbs.tiles) {
+            if (preview) preview.classList.add('hidden');
+            return;
+        }
+        const slot = n % thumbs.per_tile;
+        preview.style.width = `${thumbs.width}px`;
+        preview.style.height = `${thumbs.height}px`;
+        preview.style.backgroundImage = `url(/media/files/${fileId}/thumbnails/${tile}?${auth()})`;
+        preview.style.backgroundPosition = `-${slot * thumbs.width}px 0`;
+        preview.style.left = `${Math.max(0, event.offsetX - thumbs.width / 2)}px`;
+        preview.classList.remove('hidden');
+    };
+}
+
+function detachVideoSync() {
+    const canvas = document.getElementById('engagement-chart');
+    const section = document.getElementById('video-preview-section');
+    const video = document.getElementById('video-fragment');
+    if (canvas) canvas.onclick = canvas.onmousemove = canvas.onmouseleave = null;
+    clearInterval(mediaTokenTimer);
+    if (video) {
+        video.onerror = null;
+        video.pause();
+        video.removeAttribute('src');
+        video.load();
+    }
+    if (section) section.classList.add('hidden');
+}
+
+// Load the current user's file list and render simple rows with a delete button.
+// This function is called after a successful upload and on page load.
+// Without a cursor the list is rebuilt from the first page, with one it appends the next page.
+async function loadUserFiles(cursor = null) {
     const filesEl = document.getElementById('user-files');
-    if (res.ok) {
-        filesEl.innerHTML = data.files.map(f => `
+    if (!filesEl) return;
+    const data = await fetchUserFilesPage(cursor);
+    if (cursor && !data.ok) {
+        showLoadMoreError(filesEl);
+        return;
+    }
+    if (data.ok) {
+        const rows = data.files.map(f => `
             <div style="margin: 0.5rem 0; padding: 0.5rem; border: 1px solid #ccc; display:flex; align-items:center; gap:0.5rem; flex-wrap:wrap;">
                 <span>${f.filename} (${new Date(f.uploaded_at).toLocaleString()})</span>
 
             <button onclick="deleteFile(${f.id})" style="margin-left: auto;">Удалить</button>
             </div>
         `).join('');
+        if (cursor) {
+            renderLoadMore(filesEl, null);
+            filesEl.insertAdjacentHTML('beforeend', rows);
+        } else {
+            filesEl.innerHTML = rows;
+        }
+        renderLoadMore(filesEl, data.next_cursor, 'loadUserFiles');
     } else {
         filesEl.innerHTML = '<p style="color: red;">Error loading files</p>';
     }
@@ -359,7 +549,7 @@ async function checkAuth() {
 
     // 3) Validate token against the server
     try {
-        const res = await fetch('/media/files', {
+        const res = await fetch('/media/files?limit=1', {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         if (res.ok) {
@@ -460,30 +650,35 @@ async function deleteFile(id) {
 
 
 // New function for algorithm page to load files in a selectable list
-async function loadAlgorithmFiles() {
-    const token = localStorage.getItem('token');
-    const res = await fetch('/media/files', {
-        headers: { 'Authorization': `Bearer ${token}` }
-    });
-    const data = await res.json();
+async function loadAlgorithmFiles(cursor = null) {
+    const data = await fetchUserFilesPage(cursor);
     const filesEl = document.getElementById('file-list');
-
-    if (res.ok && data.files.length > 0) {
-        filesEl.innerHTML = `
-            <p>Select a file to analyze:</p>
-            <div class="stack">
-                ${data.files.map(f => `
+    if (cursor && !data.ok) {
+        showLoadMoreError(filesEl);
+        return;
+    }
+    const items = data.files.map(f => `
                     <div class="file-item" style="padding: 0.5rem; border: 1px solid #ddd; border-radius: 4px; cursor: pointer;"
                          onclick="selectFile(${f.id}, this)" data-filename="${f.filename}">
                             ${f.filename}
                             <small class="muted">(${new Date(f.uploaded_at).toLocaleString()})</small>
                     </div>
-                `).join('')}
+                `).join('');
+
+    if (cursor) {
+        filesEl.querySelector('.stack').insertAdjacentHTML('beforeend', items);
+    } else if (data.ok && data.files.length > 0) {
+        filesEl.innerHTML = `
+            <p>Select a file to analyze:</p>
+            <div class="stack">
+                ${items}
             </div>
         `;
     } else {
         filesEl.innerHTML = '<p>No files available. <a href="/upload">Upload some files first</a>.</p>';
+        return;
     }
+    renderLoadMore(filesEl, data.next_cursor, 'loadAlgorithmFiles');
 }
 
 
@@ -497,7 +692,7 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
 
     ctx.clearRect(0, 0, w, h);
 
-    if (!series1 || !series2 || series1.length === 0 || series2.length === 0) {
+    if (!series1 || !series2 || series1.t.length === 0 || series2.t.length === 0) {
         ctx.fillStyle = '#666';
         ctx.font = '16px sans-serif';
         ctx.textAlign = 'center';
@@ -505,21 +700,9 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
         return;
     }
 
-    // Сбор всех времён и значений
-    const allTimes = [];
-    const allValues = [];
-
-    [series1, series2].forEach(series => {
-        series.forEach(p => {
-            const t = Number(p.t) || 0;
-            const v = Number(p.value) || 0;
-            allTimes.push(t);
-            allValues.push(v);
-        });
-    });
-
-    const tMin = Math.min(...allTimes);
-    const tMax = Math.max(...allTimes);
+    // Времена каждой серии отсортированы
+    const tMin = Math.min(series1.t[0], series2.t[0]);
+    const tMax = Math.max(series1.t[series1.t.length - 1], series2.t[series2.t.length - 1]);
     const vMin = 0;
     const vMax = 1;
     const actualDuration = commonDuration || (tMax - tMin);
@@ -593,8 +776,8 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
 
     [series1, series2].forEach((series, seriesIndex) => {
         const color = colors[seriesIndex];
-        const times = series.map(p => Number(p.t) || 0);
-        const values = series.map(p => Number(p.value) || 0);
+        const times = series.t;
+        const values = series.value;
 
         // === 1. Рисуем ЛИНИЮ по ВСЕМ точкам (без интерполяции) ===
         ctx.strokeStyle = color;
@@ -727,7 +910,7 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
     // Clear
     ctx.clearRect(0, 0, w, h);
 
-    if (!series1 || !series2 || series1.length === 0 || series2.length === 0) {
+    if (!series1 || !series2 || series1.t.length === 0 || series2.t.length === 0) {
         ctx.fillStyle = '#666';
         ctx.font = '16px sans-serif';
         ctx.textAlign = 'center';
@@ -735,14 +918,14 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
         return;
     }
 
-    // Calculate individual time ranges
-    const times1 = series1.map(p => Number(p.t) || 0);
-    const times2 = series2.map(p => Number(p.t) || 0);
+    // Calculate individual time ranges; times are sorted
+    const times1 = series1.t;
+    const times2 = series2.t;
 
-    const tMin1 = Math.min(...times1);
-    const tMax1 = Math.max(...times1);
-    const tMin2 = Math.min(...times2);
-    const tMax2 = Math.max(...times2);
+    const tMin1 = times1[0];
+    const tMax1 = times1[times1.length - 1];
+    const tMin2 = times2[0];
+    const tMax2 = times2[times2.length - 1];
 
     // Use the maximum duration from both files
     const globalTMin = 0;
@@ -826,21 +1009,23 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
     // Draw both series with their own time ranges
     [series1, series2].forEach((series, seriesIndex) => {
         const color = colors[seriesIndex];
-        const times = series.map(p => Number(p.t) || 0);
-        const values = series.map(p => Number(p.value) || 0);
+        const times = series.t;
+        const values = series.value;
 
         // Shift times to start from 0 for this series
         const seriesMinTime = seriesIndex === 0 ? tMin1 : tMin2;
-        const shiftedTimes = times.map(t => t - seriesMinTime);
 
-        // Sort points by time
-        const pairs = shiftedTimes.map((t, i) => ({ t, v: values[i] })).sort((a,b) => a.t - b.t);
-
-        // If too few points, interpolate for smooth chart
-        let pointsToDraw = pairs;
-        console.log(pairs.length);
-        if (pairs.length < 20 && pairs.length > 1) {
-            pointsToDraw = interpolateSeries(pairs, 20);
+        // If too few points, interpolate for smooth chart; long series are drawn straight from the arrays
+        let tAt = i => times[i] - seriesMinTime;
+        let vAt = i => values[i];
+        let drawCount = times.length;
+        console.log(times.length);
+        if (times.length < 20 && times.length > 1) {
+            const pairs = Array.from(times, (t, i) => ({ t: t - seriesMinTime, v: values[i] }));
+            const pointsToDraw = interpolateSeries(pairs, 20);
+            tAt = i => pointsToDraw[i].t;
+            vAt = i => pointsToDraw[i].v;
+            drawCount = pointsToDraw.length;
         }
 
         // Draw line
@@ -848,9 +1033,9 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
         ctx.lineWidth = 2;
         ctx.beginPath();
         let hasPoints = false;
-        for (let i = 0; i < pointsToDraw.length; i++) {
-            const px = x(pointsToDraw[i].t);
-            const py = y(pointsToDraw[i].v);
+        for (let i = 0; i < drawCount; i++) {
+            const px = x(tAt(i));
+            const py = y(vAt(i));
             if (i === 0) {
                 ctx.moveTo(px, py);
                 hasPoints = true;
@@ -864,11 +1049,11 @@ function renderComparisonChart(series1, series2, label1 = 'File 1', label2 = 'Fi
 
         // Draw points - only for original points
         ctx.fillStyle = color;
-        for (let i = 0; i < pairs.length; i++) {
+        for (let i = 0; i < times.length; i++) {
             // Show every Nth point to avoid clutter
-//            if (i % Math.max(1, Math.floor(pairs.length / 10)) === 0 || i === pairs.length - 1) {
-                const px = x(pairs[i].t);
-                const py = y(pairs[i].v);
+//            if (i % Math.max(1, Math.floor(times.length / 10)) === 0 || i === times.length - 1) {
+                const px = x(times[i] - seriesMinTime);
+                const py = y(values[i]);
                 ctx.beginPath();
 //                ctx.arc(px, py, 3, 0, Math.PI * 2);
                 ctx.fill();
@@ -0,0 +1,146 @@
+"""Scripted load generator for the FastAPI tier.
+
+Each virtual user runs a realistic session: register, login, upload a speaker
+sample and two recordings, list files, analyze both, compare them (two
+analyzes in parallel, as algorithm.html does), then delete the uploads. The
+concurrency is raised step by step. For each step the script reports
+p50/p95/p99 latency and error rate per operation. A separate probe hits
+/meta/boot during the run: if its latency grows with concurrency, something
+is blocking the event loop.
+
+    python -m loadtest.run --base-url http://localhost:8000 --levels 1,5,10,25 --sessions 20
+"""
+import argparse
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+import httpx
+
+
+def percentile(samples, p):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[k]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name, request):
+        """Await an httpx request, recording its latency; return the response or None on failure."""
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.latencies[name].append(time.perf_counter() - started)
+        if response is None or response.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return response
+
+    def report(self, level, wall):
+        print(f"\n== concurrency {level} ({wall:.1f}s) ==")
+        print(f"{'operation':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+        for name, samples in sorted(self.latencies.items()):
+            print(f"{name:<12}{len(samples):>7}"
+                  f"{percentile(samples, 50) * 1000:>10.1f}"
+                  f"{percentile(samples, 95) * 1000:>10.1f}"
+                  f"{percentile(samples, 99) * 1000:>10.1f}"
+                  f"{100.0 * self.errors[name] / len(samples):>8.1f}%")
+
+
+async def session(client, rec, video_bytes):
+    username = f"load-{uuid4().hex[:12]}"
+    password = uuid4().hex
+    if not await rec.call("register", client.post("/auth/register", json={"username": username, "password": password})):
+        return
+    res = await rec.call("login", client.post("/auth/token", data={"username": username, "password": password}))
+    if not res:
+        return
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+    await rec.call("upload", client.post(
+        "/media/upload-audio", headers=headers, files={"file": ("sample.wav", video_bytes[:64 * 1024])}))
+    res = await rec.call("upload", client.post("/media/upload", headers=headers, files=[
+        ("files", (f"lecture-{i}.mp4", video_bytes)) for i in range(2)
+    ]))
+    if not res:
+        return
+
+    res = await rec.call("list", client.get("/media/files", headers=headers))
+    if not res:
+        return
+    ids = [f["id"] for f in res.json()["files"]]
+
+    for file_id in ids:
+        await rec.call("analyze", client.get(f"/media/files/{file_id}/analyze", headers=headers))
+    if len(ids) >= 2:
+        await asyncio.gather(*[
+            rec.call("compare", client.get(f"/media/files/{file_id}/analyze", headers=headers))
+            for file_id in ids[:2]
+        ])
+
+    for file_id in ids:
+        await rec.call("delete", client.delete(f"/media/files/{file_id}", headers=headers))
+
+
+async def loop_probe(client, rec, stop, interval):
+    while not stop.is_set():
+        await rec.call("loop-probe", client.get("/meta/boot"))
+        await asyncio.sleep(interval)
+
+
+async def run_level(base_url, level, sessions, video_bytes, timeout):
+    rec = Recorder()
+    limits = httpx.Limits(max_connections=level + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(loop_probe(client, rec, stop, interval=0.1))
+        queue = asyncio.Queue()
+        for _ in range(sessions):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                await session(client, rec, video_bytes)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(level)])
+        wall = time.perf_counter() - started
+        stop.set()
+        await probe
+    rec.report(level, wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--levels", default="1,5,10,25", help="comma separated concurrency steps")
+    parser.add_argument("--sessions", type=int, default=20, help="sessions per concurrency step")
+    parser.add_argument("--video", help="file to upload; random bytes are used if omitted")
+    parser.add_argument("--video-size", type=int, default=1024 * 1024, help="size of the random upload in bytes")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    if args.video:
+        with open(args.video, "rb") as f:
+            video_bytes = f.read()
+    else:
+        video_bytes = os.urandom(args.video_size)
+
+    for level in [int(x) for x in args.levels.split(",") if x]:
+        asyncio.run(run_level(args.base_url, level, args.sessions, video_bytes, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
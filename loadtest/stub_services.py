@@ -0,0 +1,111 @@
+"""Stand-ins for main-, video- and audio-service, for load-testing the API without the models.
+
+One process serves /process, /process_video, /process_audio, /probe_video and
+/health with the same request and response shapes as the real services.
+Latency, failure rate and series length are configurable:
+
+    python -m loadtest.stub_services --port 5000 --latency 2 --jitter 0.5 --failure-rate 0.02 --points 10000
+
+Then start the API with MAIN_SERVICE_URL=http://localhost:5000/process.
+"""
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.media.series import SERIES_MEDIA_TYPE, pack_series
+
+app = FastAPI()
+config = {"latency": 0.5, "jitter": 0.1, "failure_rate": 0.0, "points": 1000, "step": 0.333, "duration": 600.0}
+
+
+async def simulate_work():
+    """Sleep for the configured latency; return an error response on a simulated failure."""
+    await asyncio.sleep(max(0.0, random.gauss(config["latency"], config["jitter"])))
+    if random.random() < config["failure_rate"]:
+        return JSONResponse({"error": "simulated failure"}, status_code=500)
+    return None
+
+
+def fake_series(start=0.0, end=None):
+    end = config["points"] * config["step"] if end is None else end
+    n = max(0, int((end - start) / config["step"]))
+    times = [round(start + i * config["step"], 3) for i in range(n)]
+    return times, [random.random() for _ in times]
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ready", "stub": True}
+
+
+@app.post("/process")
+async def process(request: Request):
+    data = await request.json()
+    if not data.get("video_path") or not data.get("sample_path"):
+        return JSONResponse({"error": "video_path and sample_path are required"}, status_code=400)
+    failed = await simulate_work()
+    if failed:
+        return failed
+    times, values = fake_series()
+    if data.get("format") == "binary":
+        return Response(pack_series(times, values), media_type=SERIES_MEDIA_TYPE)
+    return {str(t): v for t, v in zip(times, values)}
+
+
+@app.post("/process_video")
+async def process_video(request: Request):
+    data = await request.json()
+    if not data.get("video_path"):
+        return JSONResponse({"error": "video_path is required"}, status_code=400)
+    failed = await simulate_work()
+    if failed:
+        return failed
+    times, values = fake_series(data.get("start") or 0.0, data.get("end"))
+    return {"result": {str(t): v * 100 for t, v in zip(times, values)}}
+
+
+@app.post("/process_audio")
+async def process_audio(request: Request):
+    data = await request.json()
+    if not data.get("video_path") or not data.get("sample_path"):
+        return JSONResponse({"error": "video_path and sample_path are required"}, status_code=400)
+    failed = await simulate_work()
+    if failed:
+        return failed
+    start = int(data.get("start") or 0)
+    end = int(data.get("end") or config["points"] * config["step"])
+    result = {f"({float(t)}, {float(t + 1)})": random.random() * 100 for t in range(start, end)}
+    if data.get("normalize", True):
+        return {"result": result}
+    return {"result": result, "min": 0.0, "max": 100.0}
+
+
+@app.post("/probe_video")
+async def probe_video(request: Request):
+    data = await request.json()
+    if not data.get("video_path"):
+        return JSONResponse({"error": "video_path is required"}, status_code=400)
+    return {"duration": config["duration"], "fps": 30.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=config["latency"], help="mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=config["jitter"], help="stddev of the latency")
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"], help="0..1 share of 500s")
+    parser.add_argument("--points", type=int, default=config["points"], help="points in a /process series")
+    parser.add_argument("--duration", type=float, default=config["duration"], help="seconds reported by /probe_video")
+    args = parser.parse_args()
+    config.update(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                  points=args.points, duration=args.duration)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()